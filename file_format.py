@@ -2,7 +2,11 @@
 # copyright notices and license terms.
 import logging
 import os.path
+import random
+import time
 import unicodedata
+from array import array
+from collections.abc import Mapping
 from trytond.model import ModelSQL, ModelView, fields
 from trytond.pool import Pool
 from trytond.pyson import Eval, Greater, Not
@@ -34,6 +38,76 @@ def unaccent(text):
         .decode('ascii'))
 
 
+class CSVMemoryResult(Mapping):
+    '''Result of a memory CSV export
+
+    The whole file is kept in a single utf-8 bytes buffer and an array of
+    line offsets, so looking up the line of a record returns a memoryview
+    slice of the buffer instead of a copy.
+
+    If a record appears more than once, it maps to the line of its first
+    occurrence and the other lines are only reachable through line(), so
+    line_count may be greater than the number of records in the mapping.
+    '''
+
+    def __init__(self, records, lines, header_line=None):
+        chunks = []
+        if header_line is not None:
+            chunks.append((header_line + '\r\n').encode('utf-8'))
+        start = len(chunks[0]) if chunks else 0
+        # offsets[i] is the start of the line of the i-th record and
+        # offsets[i + 1] the start of the next one (line break included)
+        self._offsets = array('Q', [start])
+        for line in lines:
+            chunk = (line + '\r\n').encode('utf-8')
+            chunks.append(chunk)
+            start += len(chunk)
+            self._offsets.append(start)
+        self.buffer = b''.join(chunks)
+        self._index = {}
+        for i, record in enumerate(records):
+            self._index.setdefault(record, i)
+
+    @property
+    def data(self):
+        '''The full file content as string
+
+        It is decoded on each access, use bytes() to avoid the copy.
+        '''
+        return self.buffer.decode('utf-8')
+
+    @property
+    def line_count(self):
+        'The number of lines without the header'
+        return len(self._offsets) - 1
+
+    def line(self, index):
+        'Return the line at position index as memoryview, without line break'
+        if index < 0:
+            index += self.line_count
+        if not 0 <= index < self.line_count:
+            raise IndexError('line index out of range')
+        start = self._offsets[index]
+        # The line break is always 2 bytes in utf-8
+        end = self._offsets[index + 1] - 2
+        return memoryview(self.buffer)[start:end]
+
+    def __getitem__(self, record):
+        return self.line(self._index[record])
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __bytes__(self):
+        return self.buffer
+
+    def __str__(self):
+        return self.data
+
+
 class FileFormat(ModelSQL, ModelView):
     '''File Format'''
     __name__ = 'file.format'
@@ -89,6 +163,7 @@ class FileFormat(ModelSQL, ModelView):
         super(FileFormat, cls).__setup__()
         cls.__rpc__.update({
                 'export_file': RPC(instantiate=0),
+                'estimate_export': RPC(instantiate=0),
                 })
 
     @staticmethod
@@ -211,16 +286,160 @@ class FileFormat(ModelSQL, ModelView):
         return template.render(template_context)
 
     def export_file(self, records):
+        '''Export records following the file format
+
+        With memory storage it returns the generated content: for XML a
+        dictionary with the file of each record and for CSV a
+        CSVMemoryResult, where result[record] is the line of the record as
+        memoryview and result.data (or str(result)) is the whole file.
+        '''
+        self.check_file_type()
         if self.file_type == 'csv':
             return self.export_csv(records)
-        elif self.file_type == 'xml':
-            return self.export_xml(records)
-        else:
+        return self.export_xml(records)
+
+    def check_file_type(self):
+        if self.file_type not in ('csv', 'xml'):
             raise UserError(gettext('file_format.msg_file_type_not_exisit',
                 file_type=self.file_type,
                 file_format=self.name,
                 ))
 
+    def estimate_export(self, records, sample_size=100, slowest=5):
+        '''Estimate the size and duration of exporting records
+
+        Renders a random sample of records through the same pipeline as
+        export_file, without writing anything, and extrapolates the totals.
+
+        :param records: The records that would be exported
+        :param sample_size: Maximum number of records to render, at least 1
+        :param slowest: Number of slowest field expressions to report, at
+            least 0
+        :return: A dictionary with the estimated rows, bytes and seconds,
+            the number of sampled records and the slowest fields as a list
+            of (name, seconds per record). If records is empty nothing
+            would be exported, so rows, bytes and seconds are 0.
+        '''
+        self.check_file_type()
+        if sample_size < 1:
+            raise UserError(gettext('file_format.msg_invalid_sample_size',
+                sample_size=sample_size,
+                file_format=self.rec_name,
+                ))
+        if slowest < 0:
+            raise UserError(gettext('file_format.msg_invalid_slowest',
+                slowest=slowest,
+                file_format=self.rec_name,
+                ))
+
+        records = list(records)
+        total = len(records)
+        sample = random.sample(records, min(sample_size, total))
+
+        size = 0
+        header_line = None
+        field_times = {}
+        start = time.perf_counter()
+        for record in sample:
+            if self.file_type == 'csv':
+                content, header_line = self._csv_line(record, field_times)
+                content += '\r\n'
+            else:
+                # Depending on the engine the content may not be a string
+                content = self._xml_content(record)
+            if not isinstance(content, bytes):
+                content = str(content).encode('utf-8')
+            size += len(content)
+        duration = time.perf_counter() - start
+
+        ratio = total / len(sample) if sample else 0
+        rows = total
+        size = int(size * ratio)
+        # Like export_csv, on disk the header is only written to a new file
+        if (self.file_type == 'csv' and self.header and sample
+                and (self.storage_type == 'memory'
+                    or not os.path.isfile(
+                        self.path + "/" + self.file_name))):
+            rows += 1
+            size += len((header_line + '\r\n').encode('utf-8'))
+        names = [f.name for f in self.ffields]
+        slowest_fields = sorted(
+            ((names[i], t / len(sample)) for i, t in field_times.items()),
+            key=lambda x: x[1], reverse=True)[:slowest]
+        return {
+            'records': total,
+            'sample_size': len(sample),
+            'rows': rows,
+            'bytes': size,
+            'seconds': duration * ratio,
+            'slowest_fields': slowest_fields,
+            }
+
+    def _csv_line(self, record, field_times=None):
+        '''Return the CSV line of record and the header line, without line
+        break
+
+        :param field_times: If set, a dictionary where the time spent on
+            each field is accumulated by its position in ffields
+        '''
+        cells = []
+        headers = []
+        for i, field in enumerate(self.ffields):
+            if field_times is not None:
+                field_start = time.perf_counter()
+                cell, header = self.format_csv_field(field, record)
+                field_times[i] = (field_times.get(i, 0.0)
+                    + time.perf_counter() - field_start)
+            else:
+                cell, header = self.format_csv_field(field, record)
+            cells.append(cell)
+            headers.append(header)
+        separator = self.separator or ''
+        return separator.join(cells), separator.join(headers)
+
+    def _xml_content(self, record):
+        return self.eval(self.xml_format, record, self.engine)
+
+    def format_csv_field(self, field, record):
+        '''Return the formatted cell of field for record and its header
+        '''
+        if field and field.expression:
+            field_eval = self.eval(
+                field.expression, record, self.engine)
+            if field.number_format:
+                if field_eval.isdigit():
+                    field_eval = field.number_format % int(field_eval)
+                else:
+                    field_eval = (
+                        field.number_format % float(field_eval))
+            if field.decimal_character:
+                field_eval = str(field_eval).replace('.',
+                    unaccent(field.decimal_character) or '')
+        else:
+            field_eval = ''
+
+        ffield = unaccent(field_eval)
+        # If the length of the field is 0, it's means that dosen't
+        # matter how many chars it take
+        if field.length > 0:
+            if field.align == 'right':
+                ffield = ffield.rjust(field.length,
+                    unaccent(field.fill_character))
+            else:
+                ffield = ffield.ljust(field.length,
+                    unaccent(field.fill_character))
+            ffield = ffield[:field.length]
+
+        field_header = unaccent(field.name)
+        if self.quote:
+            if self.quote == '"':
+                ffield = ffield.replace('"', "'")
+            elif self.quote == "'":
+                ffield = ffield.replace("'", '"')
+            ffield = self.quote + ffield + self.quote
+            field_header = self.quote + field_header + self.quote
+        return ffield, field_header
+
     def export_csv(self, records):
         path = self.path
         if not path and self.storage_type == 'disk':
@@ -233,61 +452,14 @@ class FileFormat(ModelSQL, ModelView):
         lines = []
         result = {}
         for record in records:
-            fields = []
-            headers = []
-            for field in self.ffields:
-                if field and field.expression:
-                    field_eval = self.eval(
-                        field.expression, record, self.engine)
-                    if field.number_format:
-                        if field_eval.isdigit():
-                            field_eval = field.number_format % int(field_eval)
-                        else:
-                            field_eval = (
-                                field.number_format % float(field_eval))
-                    if field.decimal_character:
-                        field_eval = str(field_eval).replace('.',
-                            unaccent(field.decimal_character) or '')
-                else:
-                    field_eval = ''
-
-                ffield = unaccent(field_eval)
-                # If the length of the field is 0, it's means that dosen't
-                # matter how many chars it take
-                if field.length > 0:
-                    if field.align == 'right':
-                        ffield = ffield.rjust(field.length,
-                            unaccent(field.fill_character))
-                    else:
-                        ffield = ffield.ljust(field.length,
-                            unaccent(field.fill_character))
-                    ffield = ffield[:field.length]
-
-                field_header = unaccent(field.name)
-                if self.quote:
-                    if self.quote == '"':
-                        ffield = ffield.replace('"', "'")
-                    elif self.quote == "'":
-                        ffield = ffield.replace("'", '"')
-                    ffield = self.quote + ffield + self.quote
-                    field_header = self.quote + field_header + self.quote
-
-                fields.append(ffield)
-                headers.append(field_header)
-
-            separator = self.separator or ''
-            lines.append(separator.join(fields))
+            line, header = self._csv_line(record)
+            lines.append(line)
             if not header_line:
-                header_line.append(separator.join(headers))
+                header_line.append(header)
 
         if self.storage_type == 'memory':
-            data = ''
-            if self.header:
-                for header in header_line:
-                    data += header + "\r\n"
-            for line in lines:
-                data += line + "\r\n"
-            result = {x: data for x in records}
+            result = CSVMemoryResult(records, lines,
+                header_line[0] if self.header and header_line else None)
         else:
             try:
                 file_path = path + "/" + self.file_name
@@ -320,7 +492,7 @@ class FileFormat(ModelSQL, ModelView):
 
         result = {}
         for record in records:
-            xml = self.eval(self.xml_format, record, self.engine)
+            xml = self._xml_content(record)
             if self.storage_type == 'memory':
                 result[record] = xml
             else:
@@ -6,6 +6,7 @@ import os.path
 import tempfile
 from trytond.tests.test_tryton import ModuleTestCase, with_transaction
 from trytond.pool import Pool
+from trytond.exceptions import UserError
 
 
 class FileFormatTestCase(ModuleTestCase):
@@ -145,5 +146,162 @@ class FileFormatTestCase(ModuleTestCase):
         """)
         os.unlink(file_path)
 
+    @with_transaction()
+    def test0020export_csv_memory(self):
+        '''
+        Test FileFormat.export_csv with memory storage.
+        '''
+        pool = Pool()
+        Model = pool.get('ir.model')
+        FileFormat = pool.get('file.format')
+        FileFormatField = pool.get('file.format.field')
+
+        model_model, = Model.search([
+                ('name', '=', 'ir.model'),
+                ])
+        records = Model.search([
+                ('name', 'in', ['file.format', 'file.format.field']),
+                ], order=[('name', 'ASC')])
+
+        file_format = FileFormat()
+        file_format.name = 'CSV Memory File Format Test'
+        file_format.storage_type = 'memory'
+        file_format.file_type = 'csv'
+        file_format.header = True
+        file_format.separator = ','
+        file_format.quote = '"'
+        file_format.model = model_model
+        file_format.save()
+
+        for i, fieldname in enumerate(('module', 'name')):
+            field = FileFormatField()
+            field.format = file_format
+            field.name = fieldname
+            field.sequence = i
+            field.expression = '{{ record.%s }}' % fieldname
+            field.save()
+
+        result = file_format.export_file(records)
+
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result.data, (
+                '"module","name"\r\n'
+                '"file_format","file.format"\r\n'
+                '"file_format","file.format.field"\r\n'))
+        line = result[records[1]]
+        self.assertIsInstance(line, memoryview)
+        self.assertEqual(bytes(line), b'"file_format","file.format.field"')
+        self.assertEqual(bytes(result.line(0)), b'"file_format","file.format"')
+
+    @with_transaction()
+    def test0030estimate_export(self):
+        '''
+        Test FileFormat.estimate_export.
+        '''
+        pool = Pool()
+        Model = pool.get('ir.model')
+        FileFormat = pool.get('file.format')
+        FileFormatField = pool.get('file.format.field')
+
+        model_model, = Model.search([
+                ('name', '=', 'ir.model'),
+                ])
+        records = Model.search([], limit=3)
+        self.assertEqual(len(records), 3)
+
+        file_format = FileFormat()
+        file_format.name = 'CSV Estimate File Format Test'
+        file_format.storage_type = 'memory'
+        file_format.file_type = 'csv'
+        file_format.header = True
+        file_format.separator = ','
+        file_format.quote = '"'
+        file_format.model = model_model
+        file_format.save()
+
+        for i, fieldname in enumerate(('id', 'id_copy')):
+            field = FileFormatField()
+            field.format = file_format
+            field.name = fieldname
+            field.sequence = i
+            field.expression = '{{ record.id }}'
+            field.length = 8
+            field.fill_character = '0'
+            field.align = 'right'
+            field.save()
+
+        # Every line is '"000000XX","000000XX"\r\n'
+        estimate = file_format.estimate_export(records, sample_size=1)
+        self.assertEqual(estimate['records'], 3)
+        self.assertEqual(estimate['sample_size'], 1)
+        self.assertEqual(estimate['rows'], 4)
+        self.assertEqual(estimate['bytes'], len(b'"id","id_copy"\r\n')
+            + 3 * len(b'"00000000","00000000"\r\n'))
+        self.assertGreaterEqual(estimate['seconds'], 0)
+        self.assertEqual(
+            sorted(n for n, _ in estimate['slowest_fields']),
+            ['id', 'id_copy'])
+        self.assertEqual(
+            len(file_format.estimate_export(records,
+                    slowest=1)['slowest_fields']), 1)
+        self.assertEqual(
+            file_format.estimate_export(records, sample_size=3)['bytes'],
+            len(bytes(file_format.export_file(records))))
+
+        estimate = file_format.estimate_export([])
+        self.assertEqual(estimate['rows'], 0)
+        self.assertEqual(estimate['bytes'], 0)
+        self.assertEqual(estimate['seconds'], 0)
+
+        with self.assertRaises(UserError):
+            file_format.estimate_export(records, sample_size=0)
+        with self.assertRaises(UserError):
+            file_format.estimate_export(records, slowest=-1)
+
+        # Fields sharing a name are reported separately
+        field.name = 'id'
+        field.save()
+        file_format = FileFormat(file_format.id)
+        estimate = file_format.estimate_export(records)
+        self.assertEqual(
+            [n for n, _ in estimate['slowest_fields']], ['id', 'id'])
+
+        # On disk the header is not written again to an existing file
+        with tempfile.NamedTemporaryFile() as temp_file:
+            file_format.storage_type = 'disk'
+            file_format.path = os.path.dirname(temp_file.name)
+            file_format.file_name = os.path.basename(temp_file.name)
+            estimate = file_format.estimate_export(records)
+            self.assertEqual(estimate['rows'], 3)
+            self.assertEqual(estimate['bytes'],
+                3 * len(b'"00000000","00000000"\r\n'))
+
+        file_format.file_type = 'pdf'
+        with self.assertRaises(UserError):
+            file_format.estimate_export(records)
+
+        file_format = FileFormat()
+        file_format.name = 'XML Estimate File Format Test'
+        file_format.storage_type = 'memory'
+        file_format.file_type = 'xml'
+        file_format.model = model_model
+        file_format.xml_format = '<model>{{ record.id * 0 }}</model>'
+        file_format.save()
+
+        estimate = file_format.estimate_export(records, sample_size=1)
+        self.assertEqual(estimate['records'], 3)
+        self.assertEqual(estimate['rows'], 3)
+        self.assertEqual(estimate['bytes'], 3 * len(b'<model>0</model>'))
+        self.assertEqual(estimate['slowest_fields'], [])
+
+        # Genshi renders bytes
+        file_format.engine = 'genshi'
+        file_format.xml_format = '<model>${record.id * 0}</model>'
+        file_format.save()
+
+        estimate = file_format.estimate_export(records, sample_size=1)
+        self.assertEqual(estimate['rows'], 3)
+        self.assertEqual(estimate['bytes'], 3 * len(b'<model>0</model>'))
+
 
 del ModuleTestCase